@@ -1,10 +1,85 @@
+import os
 import re
+import csv
+import string
 import json
-from typing import Any, Dict, List, Optional, Tuple, Union
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple, Union
 from sql_metadata import Parser
-import pandas as pd
+import sqlglot
+from sqlglot import exp
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps(obj: Any, indent: bool = False) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None).decode()
+    return json.dumps(obj, indent=2 if indent else None)
+
+_CREATE_RE = re.compile(r'\s*CREATE\s+(?:OR\s+REPLACE\s+)?(?:TABLE|VIEW)\s+(?:IF\s+NOT\s+EXISTS\s+)?([`"\[\w\.]+)(?:\s+AS\b)?', re.IGNORECASE)
+_VIEW_SELECT_HEAD_RE = re.compile(r'\bAS\b\s*\(\s*SELECT\s+', re.IGNORECASE)
+_FROM_KEYWORD_RE = re.compile(r'\bFROM\b', re.IGNORECASE)
+_COLUMN_ALIAS_RE = re.compile(r'\bAS\b\s+([`"\[\w]+)', re.IGNORECASE)
+_FUNC_WRAPPER_RE = re.compile(r'.*\(|\).*')
+_COLUMNS_BLOCK_RE = re.compile(r'\(\s*(.*?)\s*\)[^)]*$', re.DOTALL)
+# Table-level constraint clauses are tried first, so a single match per column
+# definition either flags it as a constraint or yields the column name.
+_COLUMN_DEF_RE = re.compile(
+    r'\s*(?:(?P<constraint>CONSTRAINT|PRIMARY\s+KEY|FOREIGN\s+KEY|UNIQUE|CHECK|INDEX)|(?P<name>[`"\[\w]+))',
+    re.IGNORECASE
+)
+_STRIP_TABLE = str.maketrans('', '', '`"[]')
+_PAREN_OR_COMMA_RE = re.compile(r'[(),]')
+
+def _split_top_level_commas(columns_def: str) -> List[str]:
+    # Jump between structural characters only and slice the text between
+    # top-level commas, instead of visiting (and concatenating) every character.
+    col_defs = []
+    start = 0
+    paren_level = 0
+    for match in _PAREN_OR_COMMA_RE.finditer(columns_def):
+        char = match.group()
+        if char == '(': paren_level += 1
+        elif char == ')': paren_level -= 1
+        elif paren_level == 0:
+            col_defs.append(columns_def[start:match.start()].strip())
+            start = match.end()
+    last_def = columns_def[start:].strip()
+    if last_def:
+        col_defs.append(last_def)
+    return col_defs
+
+def _extract_view_select_list(statement: str) -> Optional[str]:
+    # Text between "AS (SELECT" and the first FROM or ')' (or the end of the statement),
+    # located with forward-only searches instead of a lazy '.*?' + alternation regex.
+    head_match = _VIEW_SELECT_HEAD_RE.search(statement)
+    if not head_match:
+        return None
+    start = head_match.end()
+    end = len(statement)
+    from_match = _FROM_KEYWORD_RE.search(statement, start)
+    if from_match:
+        end = from_match.start()
+    paren_pos = statement.find(')', start, end)
+    if paren_pos != -1:
+        end = paren_pos
+    return statement[start:end]
 
 def generate_table_mapping_from_create_statements(create_statements: str) -> Dict[str, List[str]]:
+    # Callers get a fresh dict of lists so mutating it never touches the cached parse.
+    return {table: list(columns) for table, columns in _generate_table_mapping_cached(create_statements)}
+
+@functools.lru_cache(maxsize=64)
+def _generate_table_mapping_cached(create_statements: str) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
     result_mapping = {}
     statements = create_statements.split(';')
     
@@ -13,8 +88,7 @@ def generate_table_mapping_from_create_statements(create_statements: str) -> Dic
         if not statement:
             continue
             
-        create_match = re.match(r'\s*CREATE\s+(?:OR\s+REPLACE\s+)?(?:TABLE|VIEW)\s+(?:IF\s+NOT\s+EXISTS\s+)?([`"\[\w\.]+)(?:\s+AS\b)?', 
-                                statement, re.IGNORECASE)
+        create_match = _CREATE_RE.match(statement)
         
         if not create_match:
             continue
@@ -22,65 +96,92 @@ def generate_table_mapping_from_create_statements(create_statements: str) -> Dic
         table_name = create_match.group(1)
         if '.' in table_name:
             table_name = table_name.split('.')[-1]
-        table_name = re.sub(r'[`"\[\]]', '', table_name).lower()
+        table_name = table_name.translate(_STRIP_TABLE).lower()
         
         columns = ['*']
         
-        view_select_match = re.search(r'\bAS\b\s*\(\s*SELECT\s+(.*?)(?:\bFROM\b|\);?|$)', 
-                                    statement, re.IGNORECASE | re.DOTALL)
+        view_select_list = _extract_view_select_list(statement)
         
-        if view_select_match:
-            select_columns = view_select_match.group(1).strip()
-            col_list = re.split(r',\s*', select_columns)
+        if view_select_list is not None:
+            select_columns = view_select_list.strip()
+            col_list = [part.strip() for part in select_columns.split(',')]
             for col in col_list:
                 col = col.strip()
-                alias_match = re.search(r'\bAS\b\s+([`"\[\w]+)', col, re.IGNORECASE)
+                alias_match = _COLUMN_ALIAS_RE.search(col)
                 if alias_match:
                     col_name = alias_match.group(1)
                 else:
-                    parts = re.split(r'\.', col)
+                    parts = col.split('.')
                     col_name = parts[-1].strip() if parts else col.strip()
-                    col_name = re.sub(r'.*\(|\).*', '', col_name).strip() 
+                    col_name = _FUNC_WRAPPER_RE.sub('', col_name).strip() 
                 
-                col_name = re.sub(r'[`"\[\]]', '', col_name).lower()
+                col_name = col_name.translate(_STRIP_TABLE).lower()
                 if col_name and col_name not in columns and col_name != '*':
                     columns.append(col_name)
         else:
-            columns_match = re.search(r'\(\s*(.*?)\s*\)[^)]*$', statement, re.DOTALL)
+            columns_match = _COLUMNS_BLOCK_RE.search(statement)
             if columns_match:
                 columns_def = columns_match.group(1).strip()
-                col_defs = []
-                current_def = ""
-                paren_level = 0
-                
-                for char in columns_def:
-                    if char == '(': paren_level += 1
-                    elif char == ')': paren_level -= 1
-                    
-                    if char == ',' and paren_level == 0:
-                        col_defs.append(current_def.strip())
-                        current_def = ""
-                    else:
-                        current_def += char
-                
-                if current_def.strip():
-                    col_defs.append(current_def.strip())
+                col_defs = _split_top_level_commas(columns_def)
                 
                 for col_def in col_defs:
-                    if re.match(r'\s*(CONSTRAINT|PRIMARY\s+KEY|FOREIGN\s+KEY|UNIQUE|CHECK|INDEX)', 
-                                col_def, re.IGNORECASE):
-                        continue
-                    
-                    col_match = re.match(r'\s*([`"\[\w]+)', col_def)
-                    if col_match:
-                        col_name = col_match.group(1)
-                        col_name = re.sub(r'[`"\[\]]', '', col_name).lower()
+                    col_match = _COLUMN_DEF_RE.match(col_def)
+                    if col_match and not col_match.group('constraint'):
+                        col_name = col_match.group('name')
+                        col_name = col_name.translate(_STRIP_TABLE).lower()
                         if col_name not in columns:
                             columns.append(col_name)
         
         if len(columns) > 1:
             result_mapping[table_name] = columns
-    return result_mapping
+    return tuple((table, tuple(columns)) for table, columns in result_mapping.items())
+
+# Patterns below run case-sensitively against the ASCII-lowercased query (see inspect_query).
+_SELECT_START_RE = re.compile(r'\s*select', re.DOTALL)
+_CTE_SELECT_START_RE = re.compile(r'\s*with\s+.*?\s+as\s*\(.*?\)\s*select', re.DOTALL)
+_DISALLOWED_KEYWORDS = ('DROP', 'DELETE', 'TRUNCATE', 'UPDATE', 'INSERT', 'ALTER', 'CREATE', 'GRANT', 'REVOKE')
+_DISALLOWED_RE = re.compile(r'\b(?P<kw>' + '|'.join(_DISALLOWED_KEYWORDS).lower() + r')\b')
+# One named group per unsafe pattern; issues are reported in this declaration order.
+_UNSAFE_PATTERNS = (
+    ('xp_cmdshell', r'xp_cmdshell'),
+    ('exec', r'exec[\s(]'),
+    ('sp', r'sp_'),
+    ('xp', r'xp_'),
+    ('comment', r';\s*--'),
+)
+_UNSAFE_RE = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in _UNSAFE_PATTERNS))
+_LIMIT_OFFSET_RE = re.compile(r'\b(limit|offset)\b')
+_ORDER_BY_RE = re.compile(r'\border\s+by\b')
+_JOIN_RE = re.compile(r'\bjoin\s+([\w.]+)(\s+\w+)?(?!\s+(on|using)\b)')
+_CROSS_JOIN_RE = re.compile(r'\bcross\s+join\b')
+_JOIN_KEYWORD_RE = re.compile(r'\bjoin\b')
+_JOIN_CONDITION_RE = re.compile(r'\b(on|using)\b', re.DOTALL)
+_UNION_RE = re.compile(r'\bunion\b')
+_ASCII_LOWER_TABLE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Lowercase literals that any match of the corresponding regex must contain.
+_DISALLOWED_LITERALS = tuple(keyword.lower() for keyword in _DISALLOWED_KEYWORDS)
+_UNSAFE_LITERALS = ('xp_', 'sp_', 'exec', '--')
+_LIMIT_OFFSET_LITERALS = ('limit', 'offset')
+
+def _has_inner_semicolon(query: str) -> bool:
+    # A semicolon is only acceptable when nothing but whitespace and, optionally, a
+    # trailing single-line '--' comment follows it. Each semicolon is checked by a
+    # forward scan to the next non-whitespace character, so the cost stays linear.
+    q = query.strip()
+    last_line_start = q.rfind('\n') + 1
+    pos = q.find(';')
+    while pos != -1:
+        next_pos = pos + 1
+        while next_pos < len(q) and q[next_pos].isspace():
+            next_pos += 1
+        if next_pos < len(q) and not (q.startswith('--', next_pos) and next_pos >= last_line_start):
+            return True
+        pos = q.find(';', next_pos)
+    return False
+
+def _quickscan(query_lower: str, literals: Tuple[str, ...]) -> bool:
+    return any(literal in query_lower for literal in literals)
 
 class SQLQueryInspector:
     def __init__(self, query):
@@ -88,27 +189,32 @@ class SQLQueryInspector:
         self.issues = []
 
     def inspect_query(self):
-        if not (re.match(r'\s*SELECT', self.query, re.IGNORECASE | re.DOTALL) or
-                re.match(r'\s*WITH\s+.*?\s+AS\s*\(.*?\)\s*SELECT', self.query, re.IGNORECASE | re.DOTALL)):
+        # Lowercase ASCII letters only, so offsets in q_low line up with self.query
+        # (str.lower can change the length of some non-ASCII text).
+        q_low = self.query.lower() if self.query.isascii() else self.query.translate(_ASCII_LOWER_TABLE)
+
+        if not (_SELECT_START_RE.match(q_low) or _CTE_SELECT_START_RE.match(q_low)):
                 self.issues.append("Only SELECT statements or CTEs (WITH...SELECT) are allowed.")
 
-        disallowed_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'UPDATE', 'INSERT', 'ALTER', 'CREATE', 'GRANT', 'REVOKE']
-        for keyword in disallowed_keywords:
-            if re.search(fr'\b{keyword}\b', self.query, re.IGNORECASE):
-                self.issues.append(f"Potential disallowed operation detected: '{keyword}'.")
-
-        unsafe_keywords = ['xp_cmdshell', 'exec(\s|\()', 'sp_', 'xp_', ';\s*--']
-        for keyword_pattern in unsafe_keywords:
-                if re.search(fr'{keyword_pattern}', self.query, re.IGNORECASE):
-                    match = re.search(fr'{keyword_pattern}', self.query, re.IGNORECASE)
-                    actual_keyword = match.group(0).strip() if match else keyword_pattern
-                    self.issues.append(f"Potentially unsafe SQL pattern '{actual_keyword}' detected.")
+        if _quickscan(q_low, _DISALLOWED_LITERALS):
+            found_keywords = {m.group('kw').upper() for m in _DISALLOWED_RE.finditer(q_low)}
+            for keyword in _DISALLOWED_KEYWORDS:
+                if keyword in found_keywords:
+                    self.issues.append(f"Potential disallowed operation detected: '{keyword}'.")
+
+        if _quickscan(q_low, _UNSAFE_LITERALS):
+            first_unsafe_hits = {}
+            for m in _UNSAFE_RE.finditer(q_low):
+                first_unsafe_hits.setdefault(m.lastgroup, self.query[m.start():m.end()].strip())
+            for name, _ in _UNSAFE_PATTERNS:
+                if name in first_unsafe_hits:
+                    self.issues.append(f"Potentially unsafe SQL pattern '{first_unsafe_hits[name]}' detected.")
         
-        if re.search(r'\b(LIMIT|OFFSET)\b', self.query, re.IGNORECASE) and \
-            not re.search(r'\bORDER\s+BY\b', self.query, re.IGNORECASE):
+        if _quickscan(q_low, _LIMIT_OFFSET_LITERALS) and _LIMIT_OFFSET_RE.search(q_low) and \
+            not (_quickscan(q_low, ('order',)) and _ORDER_BY_RE.search(q_low)):
             self.issues.append("Use of LIMIT/OFFSET without ORDER BY may result in unpredictable results.")
 
-        if re.search(r';(?!\s*(--.*)?$)', self.query.strip()):
+        if _has_inner_semicolon(self.query):
             is_already_flagged_as_unsafe_semicolon_comment = False
             for issue in self.issues:
                 if ';\s*--' in issue and "Potentially unsafe SQL pattern" in issue: 
@@ -117,19 +223,16 @@ class SQLQueryInspector:
             if not is_already_flagged_as_unsafe_semicolon_comment:
                     self.issues.append("Avoid the use of semicolons (;) except possibly at the very end of the query.")
 
-        join_pattern = r'\bJOIN\s+([\w.]+)(\s+\w+)?(?!\s+(ON|USING)\b)'
-        potential_cartesian_joins = re.findall(join_pattern, self.query, re.IGNORECASE)
-        if potential_cartesian_joins:
-                if not re.search(r'\bCROSS\s+JOIN\b', self.query, re.IGNORECASE):
-                    join_match = re.search(join_pattern, self.query, re.IGNORECASE)
-                    if join_match:
-                        substring_after_join = self.query[join_match.end():]
-                        next_join_match = re.search(r'\bJOIN\b', substring_after_join, re.IGNORECASE)
-                        search_area = substring_after_join if not next_join_match else substring_after_join[:next_join_match.start()]
-                        if not re.search(r'\b(ON|USING)\b', search_area, re.IGNORECASE | re.DOTALL):
-                            self.issues.append("Use of JOIN without an ON/USING clause may result in a Cartesian product. Specify join conditions or use CROSS JOIN.")
-
-        if re.search(r'\bUNION\b', self.query, re.IGNORECASE):
+        # Only the first candidate JOIN is inspected, so a single search replaces findall + search.
+        join_match = _JOIN_RE.search(q_low) if _quickscan(q_low, ('join',)) else None
+        if join_match and not _CROSS_JOIN_RE.search(q_low):
+            substring_after_join = q_low[join_match.end():]
+            next_join_match = _JOIN_KEYWORD_RE.search(substring_after_join)
+            search_area = substring_after_join if not next_join_match else substring_after_join[:next_join_match.start()]
+            if not _JOIN_CONDITION_RE.search(search_area):
+                self.issues.append("Use of JOIN without an ON/USING clause may result in a Cartesian product. Specify join conditions or use CROSS JOIN.")
+
+        if _quickscan(q_low, ('union',)) and _UNION_RE.search(q_low):
             self.issues.append("UNION queries detected. Ensure column counts and types match in each SELECT.")
 
         if self.issues:
@@ -139,29 +242,26 @@ class SQLQueryInspector:
             return self.query
 
 agg_pattern = re.compile(r'^(COUNT|SUM|AVG|MIN|MAX)\s*\(\s*(?:\*|\w+|\bDISTINCT\b\s+\w+)\s*\)', re.IGNORECASE)
+_NILADIC_CALL_RE = re.compile(r'^\w+\(\s*\)$')
 
 def check_and_clean_columns(columns_raw, ctes_present, known_base_table_aliases, known_base_table_names):
-    cleaned_columns_for_validation = []
+    cleaned_columns_for_validation = set()
     known_prefixes = known_base_table_aliases.union(known_base_table_names)
     for col_raw_item in columns_raw: 
         col_raw = str(col_raw_item) 
         if agg_pattern.match(col_raw):
             continue
+        col_lower = col_raw.lower()
         if ctes_present:
-            if '.' in col_raw:
-                parts = col_raw.split('.', 1)
-                prefix = parts[0].lower()
-                col_name = parts[1]
-                if prefix in known_prefixes:
-                    cleaned_columns_for_validation.append(col_name.lower())
+            prefix, dot, col_name = col_lower.partition('.')
+            if dot and prefix in known_prefixes:
+                cleaned_columns_for_validation.add(col_name)
         else:
-            if '.' in col_raw:
-                col_name = col_raw.split('.')[-1].lower()
-                cleaned_columns_for_validation.append(col_name)
-            elif col_raw != '*':
-                col_name = col_raw.lower()
-                cleaned_columns_for_validation.append(col_name)
-    return list(set(cleaned_columns_for_validation))
+            if '.' in col_lower:
+                cleaned_columns_for_validation.add(col_lower.rsplit('.', 1)[-1])
+            elif col_lower != '*':
+                cleaned_columns_for_validation.add(col_lower)
+    return list(cleaned_columns_for_validation)
 
 def validate_columns(extracted_tables, cleaned_columns_for_validation, table_column_mapping):
     extracted_tables_lower = [str(t).lower() for t in extracted_tables]
@@ -193,17 +293,123 @@ def validate_columns(extracted_tables, cleaned_columns_for_validation, table_col
     else:
         return True, []
 
+# Mirrors the part of sql_metadata.Parser used below (tables, columns, with_names,
+# tables_aliases) from one sqlglot parse, following sql_metadata's conventions:
+# CTE names are not tables, alias prefixes resolve to table names, CTE/subquery
+# prefixes are dropped and references to SELECT aliases (bare, or through a
+# CTE/subquery prefix) are not columns. An alias over a plain literal is only
+# skipped within its own SELECT; seen from outside it stays a column, and
+# aliases defined inside LATERAL are not visible at all, as in sql_metadata.
+# The AST is walked once; column_refs keeps each column as an already split,
+# lowercased (table, name) pair so clean_columns needs no regex or str.split.
+class _SqlglotParser:
+    def __init__(self, query: str):
+        stmt = sqlglot.parse_one(query)
+        self.with_names = []
+        derived_names = set()
+        alias_has_source = {}
+        table_nodes = []
+        column_nodes = []
+        using_names = []
+        has_select_star = False
+        for node in stmt.walk():
+            if isinstance(node, exp.CTE):
+                self.with_names.append(node.alias)
+                derived_names.add(node.alias)
+            elif isinstance(node, exp.Subquery):
+                if node.alias:
+                    derived_names.add(node.alias)
+            elif isinstance(node, exp.Table):
+                table_nodes.append(node)
+            elif isinstance(node, exp.Column):
+                column_nodes.append(node)
+            elif isinstance(node, exp.Alias):
+                if not node.find_ancestor(exp.Lateral):
+                    has_source = node.this.find(exp.Column, exp.Star) is not None
+                    alias_has_source[node.alias] = alias_has_source.get(node.alias, False) or has_source
+            elif isinstance(node, exp.Star):
+                has_select_star = has_select_star or isinstance(node.parent, exp.Select)
+            elif isinstance(node, exp.Join):
+                using_names.extend(identifier.name for identifier in node.args.get('using') or [])
+
+        self.tables = []
+        self.tables_aliases = {}
+        for table in table_nodes:
+            if table.name in derived_names:
+                continue
+            table_name = ".".join(part for part in (table.catalog, table.db, table.name) if part)
+            if table_name not in self.tables:
+                self.tables.append(table_name)
+            if table.alias:
+                self.tables_aliases[table.alias] = table_name
+
+        self.columns = ['*'] if has_select_star else []
+        self.column_refs = set()
+        for column in column_nodes:
+            prefix = column.table
+            if not prefix and column.name in alias_has_source and not column.find_ancestor(exp.Alias):
+                if alias_has_source[column.name] or self._is_own_alias(column):
+                    continue
+            if prefix in derived_names:
+                if alias_has_source.get(column.name):
+                    continue
+                prefix = ''
+            self._add_column(self.tables_aliases.get(prefix, prefix), column.name)
+        for name in using_names:
+            self._add_column('', name)
+
+    @staticmethod
+    def _is_own_alias(column: exp.Column) -> bool:
+        select = column.find_ancestor(exp.Select)
+        return select is not None and any(
+            isinstance(projection, exp.Alias) and projection.alias == column.name
+            for projection in select.expressions
+        )
+
+    def _add_column(self, prefix: str, name: str):
+        # columns and column_refs are only ever extended together, so anything filtered
+        # out of columns above (e.g. derived-table aliases) can never reach clean_columns.
+        col = f"{prefix}.{name}" if prefix else name
+        if col not in self.columns:
+            self.columns.append(col)
+        self.column_refs.add((prefix.lower(), name.lower()))
+
+    def clean_columns(self, ctes_present: bool, known_prefixes: set) -> List[str]:
+        # Same selection as check_and_clean_columns, applied to the pre-split refs.
+        if ctes_present:
+            return list({name for prefix, name in self.column_refs if prefix and prefix in known_prefixes})
+        return list({name for prefix, name in self.column_refs if prefix or name != '*'})
+
+def _parse(query: str):
+    try:
+        return _SqlglotParser(query)
+    except sqlglot.errors.SqlglotError:
+        return Parser(query)
+
 def query_validator(query: str, current_schema_mapping: Dict[str, List[str]]) -> str:
+    # Validation only uses column membership, so the mapping can be frozen into a hashable cache key.
+    frozen_schema_mapping = frozenset(
+        (table, frozenset(columns)) for table, columns in current_schema_mapping.items()
+    )
+    return _query_validator_cached(query, frozen_schema_mapping)
+
+@functools.lru_cache(maxsize=1024)
+def _query_validator_cached(query: str, frozen_schema_mapping: FrozenSet[Tuple[str, FrozenSet[str]]]) -> str:
+    current_schema_mapping = dict(frozen_schema_mapping)
     inspector = SQLQueryInspector(query)
     output_query_or_error = inspector.inspect_query()
     if output_query_or_error != query:
         return output_query_or_error
     else:
         try:
-            parser = Parser(query)
-            tables_from_parser_for_simple_check = [str(t).lower() for t in parser.tables]
+            parser = _parse(query)
+            # Read each parser property exactly once; everything below works on these locals.
+            parser_tables = parser.tables
             columns_raw = parser.columns 
-            ctes_present = bool(parser.with_names)
+            parser_with_names = parser.with_names
+            parser_tables_aliases = parser.tables_aliases
+            tables_from_parser_for_simple_check = [str(t).lower() for t in parser_tables]
+            ctes_present = bool(parser_with_names)
 
             if not tables_from_parser_for_simple_check and not ctes_present:
                 is_simple_select_ok = True 
@@ -211,7 +417,7 @@ def query_validator(query: str, current_schema_mapping: Dict[str, List[str]]) ->
                     for c_item in columns_raw:
                         c = str(c_item) 
                         if not (c.isdigit() or c == '*' or agg_pattern.match(c) or 
-                                re.match(r'^\w+\(\s*\)$', c)): 
+                                _NILADIC_CALL_RE.match(c)): 
                             is_simple_select_ok = False
                             break
                 if is_simple_select_ok:
@@ -223,14 +429,19 @@ def query_validator(query: str, current_schema_mapping: Dict[str, List[str]]) ->
 
             base_table_aliases = {
                 str(alias).lower(): str(table).lower()
-                for alias, table in parser.tables_aliases.items()
+                for alias, table in parser_tables_aliases.items()
                 if str(table).lower() in schema_defined_base_tables
             }
             known_base_table_aliases_set = set(base_table_aliases.keys())
             
-            columns_cleaned_for_validation = check_and_clean_columns(
-                columns_raw, ctes_present, known_base_table_aliases_set, schema_defined_base_tables
-            )
+            if isinstance(parser, _SqlglotParser):
+                columns_cleaned_for_validation = parser.clean_columns(
+                    ctes_present, known_base_table_aliases_set.union(schema_defined_base_tables)
+                )
+            else:
+                columns_cleaned_for_validation = check_and_clean_columns(
+                    columns_raw, ctes_present, known_base_table_aliases_set, schema_defined_base_tables
+                )
             
             actual_base_tables_to_validate = [
                 t_parser for t_parser in tables_from_parser_for_simple_check 
@@ -262,9 +473,9 @@ def abc_response(model: str, prompt: str, temperature: float = 0.7, max_tokens:
         if "TASK INTRODUCTION:" in prompt and "EVALUATION CRITERIA:" in prompt and "LLM OUTPUT TO EVALUATE:" in prompt :
             raw_score = 8 
             reason_val = ("G-Eval Mock Reasoning: Syntactic: OK. TableSel: OK. ColSel: OK. Filter: OK. Join: N/A. Group/Agg: N/A. Semantic: Good. Efficiency: OK. Overall positive.")
-            return json.dumps({"score": raw_score, "reason": reason_val}), 0.8, 200, 50
+            return _json_dumps({"score": raw_score, "reason": reason_val}), 0.8, 200, 50
         else: 
-            return json.dumps({"score": 0.5, "reason": "Neutral assessment from judge."}), 0.5, 100, 15
+            return _json_dumps({"score": 0.5, "reason": "Neutral assessment from judge."}), 0.5, 100, 15
     else: 
         return f"Generated response by {model} for prompt: {prompt[:30]}...", 1.0, 50, 50
 
@@ -284,7 +495,7 @@ class CustomLLMAsJudgeMetric(CustomBaseMetric):
     def _format_prompt(self, **kwargs) -> str: return self.prompt_template.format(**kwargs)
     def _parse_judge_response(self, judge_response_str: str) -> Tuple[float, str, Optional[Dict]]:
         try:
-            data = json.loads(judge_response_str); score = float(data.get("score", 0.0))
+            data = _json_loads(judge_response_str); score = float(data.get("score", 0.0))
             reason = str(data.get("reason", "No reason provided by judge."))
             metadata = {k: v for k, v in data.items() if k not in ["score", "reason"]}
             return score, reason, metadata if metadata else {}
@@ -312,8 +523,12 @@ Return JSON: {{"score": <score>, "reason": "<detailed reasoning>"}}"""
     def __init__(self, task_introduction: str, evaluation_criteria: str, judge_model_id: str):
         super().__init__(name="LLM-based SQL Evaluation (GEval)", judge_model_id=judge_model_id, prompt_template=self.PROMPT_TEMPLATE)
         self._task_introduction = task_introduction; self._evaluation_criteria = evaluation_criteria
+        # Everything except {output} is fixed per instance, so format the text around it once.
+        template_head, _, template_tail = self.prompt_template.partition("{output}")
+        self._prompt_prefix = template_head.format(task_introduction=task_introduction, evaluation_criteria=evaluation_criteria)
+        self._prompt_suffix = template_tail.format()
     def _format_prompt(self, output: str, **ignored_kwargs) -> str:
-        return self.prompt_template.format(task_introduction=self._task_introduction, evaluation_criteria=self._evaluation_criteria, output=output)
+        return self._prompt_prefix + output + self._prompt_suffix
     def score(self, output: str, **ignored_kwargs) -> CustomScoreResult:
         result = super().score_llm_metric(output=output)
         parsed_score = result.score; final_reason = result.reason; metadata = result.metadata
@@ -324,6 +539,17 @@ Return JSON: {{"score": <score>, "reason": "<detailed reasoning>"}}"""
             return CustomScoreResult(self.name, normalized_score, final_reason, metadata)
         return result
 
+_SAFETY_ISSUE_MARKERS = (
+    "Only SELECT statements or CTEs are allowed",
+    "Potential disallowed operation detected",
+    "Potentially unsafe SQL pattern",
+    "Avoid the use of semicolons (;)",
+    "Use of LIMIT/OFFSET without ORDER BY",
+    "Use of JOIN without an ON/USING clause",
+    "UNION queries detected"
+)
+_SAFETY_MARKER_RE = re.compile('|'.join(map(re.escape, _SAFETY_ISSUE_MARKERS)))
+
 def txt2sql_metrics(user_question: str, predicted_sql: str, db_schema: str) -> str:
     results_list = []
     print(f"\n--- Evaluating SQL for Q: '{user_question[:70]}...' ---")
@@ -347,24 +573,10 @@ def txt2sql_metrics(user_question: str, predicted_sql: str, db_schema: str) -> s
     sql_column_hallucination_reasoning = "not hallucinated"
 
     if validation_result_str != predicted_sql:
-        safety_issue_markers = [
-            "Only SELECT statements or CTEs are allowed",
-            "Potential disallowed operation detected",
-            "Potentially unsafe SQL pattern",
-            "Avoid the use of semicolons (;)",
-            "Use of LIMIT/OFFSET without ORDER BY",
-            "Use of JOIN without an ON/USING clause",
-            "UNION queries detected"
-        ]
-        is_safety_issue_found = False
-        for marker in safety_issue_markers:
-            if marker in validation_result_str:
-                sql_safety_score = 1 # 1 means unsafe
-                sql_safety_score_reasoning = validation_result_str
-                is_safety_issue_found = True
-                break
-        
-        if not is_safety_issue_found:
+        if _SAFETY_MARKER_RE.search(validation_result_str):
+            sql_safety_score = 1 # 1 means unsafe
+            sql_safety_score_reasoning = validation_result_str
+        else:
             sql_column_hallucination = 1 # 1 means hallucinated
             sql_column_hallucination_reasoning = validation_result_str
 
@@ -382,6 +594,17 @@ def txt2sql_metrics(user_question: str, predicted_sql: str, db_schema: str) -> s
     })
     print(f"   SQL Column Hallucination Score: {sql_column_hallucination}, Reasoning: {sql_column_hallucination_reasoning[:100]}...")
 
+    if sql_safety_score == 1:
+        # An unsafe query is not worth a judge LLM round trip; record a zero relevancy score instead.
+        print("3. Skipping LLM-based SQL Evaluation (GEval): query flagged unsafe.")
+        results_list.append({
+            "name": "sql_relevancy_score",
+            "score": 0.0,
+            "reason": "skipped: query flagged unsafe"
+        })
+        print("--- Evaluation Complete ---")
+        return _json_dumps(results_list, indent=True)
+
     print("3. Running LLM-based SQL Evaluation (GEval) for Relevancy...")
     geval_task_intro = (f"Evaluate the SQL query for accuracy, completeness, and adherence to standard practices, considering the User Question and Database Schema.\nUser Question: \"{user_question}\"\nDatabase Schema (CREATE TABLE statements):\n{db_schema}")
     geval_criteria = """
@@ -407,7 +630,7 @@ Return a 0-10 score and detailed reasoning.
     print(f"   SQL Relevancy Score: {geval_result.score}, Reasoning: {str(geval_result.reason)[:100]}...")
 
     print("--- Evaluation Complete ---")
-    return json.dumps(results_list, indent=2)
+    return _json_dumps(results_list, indent=True)
 
 if __name__ == '__main__':
     print("--- Text-to-SQL Multi-Metric Evaluation Demo (Strict Dynamic Schema Validator) ---")
@@ -541,48 +764,60 @@ if __name__ == '__main__':
     ]
 
     schemas = {"ecommerce": ecommerce_schema}
-    results_data = []
-
-    for index, row in enumerate(test_cases_data):
-        print(f"\nProcessing Test Case ID: {row['id']} ({row['use_case']})")
-        current_schema_str = schemas.get(row['schema_name'], ecommerce_schema) 
-        metrics_json_str = txt2sql_metrics(
-            user_question=row['question'], 
-            predicted_sql=row['sql'], 
-            db_schema=current_schema_str
-        )
-        metrics_list = json.loads(metrics_json_str)
-        
-        row_results = {
-            "test_id": row['id'], 
-            "use_case": row['use_case'], 
-            "question": row['question'], 
-            "predicted_sql": row['sql'], 
-            "schema_name_used": row['schema_name']
-        }
-        
-        for metric in metrics_list:
-            metric_name_key = metric['name']
-            if metric_name_key == "sql_safety_score":
-                row_results['sql_safety_score'] = metric.get('score')
-                row_results['sql_safety_score_reasoning'] = metric.get('reason')
-            elif metric_name_key == "sql_column_hallucination":
-                row_results['sql_column_hallucination'] = metric.get('score')
-                row_results['sql_column_hallucination_reasoning'] = metric.get('reason')
-            elif metric_name_key == "sql_relevancy_score":
-                row_results['sql_relevancy_score'] = metric.get('score')
-                row_results['relevancy_reasoning'] = metric.get('reason')
-        
-        results_data.append(row_results)
-        
-        print(f"  SQL: {row['sql']}")
-        for metric_item in metrics_list:
-            print(f"  {metric_item['name']}: {metric_item.get('score')} - {str(metric_item.get('reason', 'No reason'))[:80]}...")
-            
-    df_results = pd.DataFrame(results_data)
-    print("\n--- Final Results DataFrame ---")
-    print(df_results.to_string())
-    
+    metric_result_columns = {
+        "sql_safety_score": ("sql_safety_score", "sql_safety_score_reasoning"),
+        "sql_column_hallucination": ("sql_column_hallucination", "sql_column_hallucination_reasoning"),
+        "sql_relevancy_score": ("sql_relevancy_score", "relevancy_reasoning"),
+    }
+    result_fieldnames = ["test_id", "use_case", "question", "predicted_sql", "schema_name_used"] + [
+        column for metric_columns in metric_result_columns.values() for column in metric_columns
+    ]
+    summary_lines = []
+
     csv_filename = "evaluation_results.csv"
-    df_results.to_csv(csv_filename, index=False)
+    # Each case is CPU-bound (regex + SQL parsing), so run them in separate processes
+    # rather than threads. Results are consumed in submission order and streamed to
+    # the CSV as soon as each one is ready, so no full result table is held in memory.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor, \
+            open(csv_filename, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=result_fieldnames)
+        writer.writeheader()
+        futures = [
+            executor.submit(
+                txt2sql_metrics,
+                user_question=row['question'], 
+                predicted_sql=row['sql'], 
+                db_schema=schemas.get(row['schema_name'], ecommerce_schema)
+            )
+            for row in test_cases_data
+        ]
+
+        for row, future in zip(test_cases_data, futures):
+            metrics_list = _json_loads(future.result())
+            print(f"\nTest Case ID: {row['id']} ({row['use_case']})")
+            
+            row_results = {
+                "test_id": row['id'], 
+                "use_case": row['use_case'], 
+                "question": row['question'], 
+                "predicted_sql": row['sql'], 
+                "schema_name_used": row['schema_name']
+            }
+            metrics_by_name = {metric['name']: metric for metric in metrics_list}
+            for metric_name_key, (score_column, reason_column) in metric_result_columns.items():
+                metric = metrics_by_name.get(metric_name_key, {})
+                row_results[score_column] = metric.get('score')
+                row_results[reason_column] = metric.get('reason')
+            writer.writerow(row_results)
+            summary_lines.append(
+                f"  {row['id']:<8} {row['use_case']:<22} safety={row_results['sql_safety_score']} "
+                f"hallucination={row_results['sql_column_hallucination']} relevancy={row_results['sql_relevancy_score']}"
+            )
+            
+            print(f"  SQL: {row['sql']}")
+            for metric_item in metrics_list:
+                print(f"  {metric_item['name']}: {metric_item.get('score')} - {str(metric_item.get('reason', 'No reason'))[:80]}...")
+
+    print("\n--- Final Results Summary ---")
+    print("\n".join(summary_lines))
     print(f"\nResults saved to {csv_filename}")